@@ -0,0 +1,269 @@
+"""
+Memory-footprint regression check for multi-GB transfers.
+
+Pushes synthetic uploads, delta uploads and downloads (direct, shared and signed
+shared) through every transfer path of app.py with several concurrent clients, samples process RSS and tracemalloc peaks, and
+fails (exit code 1) if the peak memory per transfer exceeds a configured ceiling.
+
+Usage:
+    python memory_regression_check.py
+
+Environment variables:
+    MEMCHECK_SIZE_MB     Size of each synthetic file (default: 2048)
+    MEMCHECK_CLIENTS     Number of concurrent clients per path (default: 2)
+    MEMCHECK_CEILING_MB  Allowed peak memory per transfer (default: 64)
+    MEMCHECK_WORKDIR     Scratch directory (default: a fresh temp dir)
+"""
+import os
+import sys
+import io
+import time
+import struct
+import shutil
+import tempfile
+import threading
+import tracemalloc
+
+SIZE_MB = int(os.getenv('MEMCHECK_SIZE_MB', '2048'))
+CLIENTS = int(os.getenv('MEMCHECK_CLIENTS', '2'))
+CEILING_MB = float(os.getenv('MEMCHECK_CEILING_MB', '64'))
+
+PATTERN = bytes(range(256)) * 4096  # 1MB repeating pattern
+
+
+class SyntheticFile(io.RawIOBase):
+    """Read-only stream of `size` deterministic bytes that never holds more than one chunk"""
+
+    def __init__(self, size):
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        remaining = self.size - self.position
+        if remaining <= 0:
+            return 0
+        count = min(len(buffer), remaining, len(PATTERN))
+        offset = self.position % len(PATTERN)
+        first = min(count, len(PATTERN) - offset)
+        buffer[:first] = PATTERN[offset:offset + first]
+        if count > first:
+            buffer[first:count] = PATTERN[:count - first]
+        self.position += count
+        return count
+
+
+class ChainedStream(io.RawIOBase):
+    """Read-only stream that reads through several streams in turn"""
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.streams:
+            count = self.streams[0].readinto(buffer)
+            if count:
+                return count
+            self.streams.pop(0)
+        return 0
+
+
+def build_delta(size, block_size):
+    """Delta that copies the first half of the blocks and sends the rest as new data
+
+    Returns the stream and its length without holding the literal data in memory.
+    """
+    copied_blocks = (size // block_size) // 2
+    literal_size = size - copied_blocks * block_size
+    parts = [io.BytesIO(b'C' + struct.pack('>II', 0, copied_blocks))]
+    length = 9
+    remaining = literal_size
+    while remaining:
+        chunk = min(remaining, 1024 * 1024 * 1024)  # D records carry a uint32 length
+        parts.append(io.BytesIO(b'D' + struct.pack('>I', chunk)))
+        parts.append(SyntheticFile(chunk))
+        length += 5 + chunk
+        remaining -= chunk
+    parts.append(io.BytesIO(b'E' + struct.pack('>Q', size)))
+    return ChainedStream(parts), length + 9
+
+
+def get_rss_mb():
+    """Get resident set size of this process in MB"""
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class RSSSampler:
+    """Sample process RSS in a background thread and keep the peak"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, get_rss_mb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = get_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, get_rss_mb())
+
+
+def upload(client, name, size):
+    response = client.post('/api/upload',
+                           data={'file': (SyntheticFile(size), name)},
+                           content_type='multipart/form-data')
+    data = response.get_json()
+    if response.status_code != 200 or not data['success']:
+        raise RuntimeError(f"Upload of {name} failed: {data}")
+    return data['file']['name']
+
+
+def drain(response, expected_size):
+    """Consume a streamed response chunk by chunk and check its length"""
+    received = 0
+    try:
+        if response.status_code != 200:
+            raise RuntimeError(f"Download failed with status {response.status_code}")
+        for chunk in response.response:
+            received += len(chunk)
+    finally:
+        response.close()
+    if received != expected_size:
+        raise RuntimeError(f"Expected {expected_size} bytes, received {received}")
+
+
+def download(client, name, size):
+    drain(client.get(f'/api/download/{name}', buffered=False), size)
+
+
+def delta_upload(client, name, size):
+    signature = client.get(f'/api/delta/{name}/signature').get_json()
+    stream, length = build_delta(size, signature['block_size'])
+    # Passed as wsgi.input directly: the test client would otherwise seek the stream
+    response = client.post(f"/api/delta/{name}?version={signature['version']}&size={size}",
+                           content_type='application/octet-stream',
+                           environ_overrides={'wsgi.input': stream, 'CONTENT_LENGTH': str(length)})
+    data = response.get_json()
+    if response.status_code != 200 or not data['success']:
+        raise RuntimeError(f"Delta upload of {name} failed: {data}")
+
+
+def shared_download(client, name, size, signed=False):
+    response = client.post('/api/share', json={'filename': name, 'signed': signed})
+    share_id = response.get_json()['share_id']
+    drain(client.post(f'/api/share/{share_id}/download', json={}, buffered=False), size)
+
+
+def run_path(label, worker, size):
+    """Run `worker` from CLIENTS concurrent threads and measure peak memory"""
+    errors = []
+
+    def run(index):
+        try:
+            worker(app.app.test_client(), index, size)
+        except Exception as e:
+            errors.append(f"client {index}: {e}")
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(CLIENTS)]
+    baseline_rss = get_rss_mb()
+    tracemalloc.reset_peak()
+    baseline_traced = tracemalloc.get_traced_memory()[0]
+    started = time.time()
+
+    with RSSSampler() as sampler:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    elapsed = time.time() - started
+    traced_peak_mb = (tracemalloc.get_traced_memory()[1] - baseline_traced) / (1024 * 1024)
+    rss_peak_mb = sampler.peak - baseline_rss
+    per_transfer_mb = max(rss_peak_mb, traced_peak_mb, 0) / CLIENTS
+    passed = not errors and per_transfer_mb <= CEILING_MB
+
+    print(f"{label:<18} {elapsed:>8.1f}s  rss +{rss_peak_mb:>8.1f}MB  "
+          f"traced +{traced_peak_mb:>8.1f}MB  per transfer {per_transfer_mb:>7.1f}MB  "
+          f"{'OK' if passed else 'FAIL'}")
+    for error in errors:
+        print(f"    {error}")
+    return passed
+
+
+def main():
+    size = SIZE_MB * 1024 * 1024
+    uploaded = []
+
+    def upload_worker(client, index, size):
+        uploaded.append(upload(client, f'upload_{index}.bin', size))
+
+    def download_worker(client, index, size):
+        download(client, uploaded[index % len(uploaded)], size)
+
+    def delta_worker(client, index, size):
+        delta_upload(client, uploaded[index % len(uploaded)], size)
+
+    def shared_download_worker(client, index, size):
+        shared_download(client, uploaded[index % len(uploaded)], size)
+
+    def signed_download_worker(client, index, size):
+        shared_download(client, uploaded[index % len(uploaded)], size, signed=True)
+
+    print(f"Memory regression check: {CLIENTS} clients x {format_size(size)}, "
+          f"ceiling {CEILING_MB:.0f}MB per transfer")
+    tracemalloc.start()
+    results = []
+    try:
+        results.append(run_path('upload', upload_worker, size))
+
+        if uploaded:
+            results.append(run_path('delta upload', delta_worker, size))
+            results.append(run_path('download', download_worker, size))
+            results.append(run_path('shared download', shared_download_worker, size))
+            results.append(run_path('signed download', signed_download_worker, size))
+    finally:
+        tracemalloc.stop()
+
+    if all(results):
+        print("All transfer paths stayed within the memory ceiling")
+        return 0
+    print("Memory ceiling exceeded or transfer failed")
+    return 1
+
+
+if __name__ == '__main__':
+    workdir = os.getenv('MEMCHECK_WORKDIR') or tempfile.mkdtemp(prefix='memcheck_')
+    os.makedirs(workdir, exist_ok=True)
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+
+    # app.py keeps its database in the working directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import app
+    from app import format_file_size as format_size
+
+    try:
+        exit_code = main()
+    finally:
+        if not os.getenv('MEMCHECK_WORKDIR'):
+            shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(exit_code)
@@ -5,10 +5,15 @@ class CloudStorage {
         this.currentUploadController = null;
         this.uploadStartTime = null;
         this.uploadStartBytes = 0;
+        this.searchQuery = '';
+        this.searchTimer = null;
+        this.deltaWorkerUrl = document.body.dataset.deltaWorkerUrl || '/static/js/delta-worker.js';
+        this.deltaMinSize = 8 * 1024 * 1024; // Smaller files are cheaper to send whole
+        this.changeSeq = null;
         
         this.initializeElements();
         this.bindEvents();
-        this.loadFiles();
+        this.loadFiles().then(() => this.watchChanges());
         this.loadStorageInfo();
     }
 
@@ -21,6 +26,7 @@ class CloudStorage {
         this.filesContainer = document.getElementById('filesContainer');
         this.loadingFiles = document.getElementById('loadingFiles');
         this.refreshBtn = document.getElementById('refreshBtn');
+        this.searchInput = document.getElementById('searchInput');
         this.storageInfo = document.getElementById('storageInfo');
         this.toastContainer = document.getElementById('toastContainer');
         this.deleteModal = document.getElementById('deleteModal');
@@ -40,6 +46,7 @@ class CloudStorage {
         this.expiresInput = document.getElementById('expiresInput');
         this.maxDownloadsInput = document.getElementById('maxDownloadsInput');
         this.passwordShareInput = document.getElementById('passwordInput');
+        this.signedShareInput = document.getElementById('signedShareInput');
         this.existingShares = document.getElementById('existingShares');
         this.sharesList = document.getElementById('sharesList');
         
@@ -90,6 +97,15 @@ class CloudStorage {
             this.loadStorageInfo();
         });
 
+        // Search as you type (debounced)
+        this.searchInput.addEventListener('input', () => {
+            clearTimeout(this.searchTimer);
+            this.searchTimer = setTimeout(() => {
+                this.searchQuery = this.searchInput.value.trim();
+                this.loadFiles();
+            }, 250);
+        });
+
         // Modal events
         this.cancelDelete.addEventListener('click', () => {
             this.hideDeleteModal();
@@ -154,11 +170,17 @@ class CloudStorage {
     async loadFiles() {
         try {
             this.showLoading();
-            const response = await fetch(`${this.apiBase}/files`);
+            const url = this.searchQuery
+                ? `${this.apiBase}/search?q=${encodeURIComponent(this.searchQuery)}&per_page=100`
+                : `${this.apiBase}/files`;
+            const response = await fetch(url);
             const data = await response.json();
 
             if (data.success) {
                 this.files = data.files;
+                if (this.changeSeq === null && data.change_seq !== undefined) {
+                    this.changeSeq = data.change_seq;
+                }
                 this.renderFiles();
             } else {
                 this.showToast('error', 'Failed to load files: ' + data.error);
@@ -190,6 +212,59 @@ class CloudStorage {
         }
     }
 
+    async watchChanges() {
+        // Long-poll the change feed and apply events instead of reloading everything
+        while (true) {
+            try {
+                const since = this.changeSeq === null ? '' : this.changeSeq;
+                const response = await fetch(`${this.apiBase}/changes?since=${since}`);
+                const data = await response.json();
+
+                if (!data.success) {
+                    throw new Error(data.error);
+                }
+
+                this.changeSeq = data.seq;
+                if (data.reset) {
+                    this.loadFiles();
+                    this.loadStorageInfo();
+                } else if (data.events.length > 0) {
+                    this.applyChanges(data.events);
+                }
+            } catch (error) {
+                console.error('Change feed error:', error);
+                await new Promise(resolve => setTimeout(resolve, 5000));
+            }
+        }
+    }
+
+    applyChanges(events) {
+        let filesChanged = false;
+
+        events.forEach(change => {
+            if (change.event === 'file_added' || change.event === 'file_updated') {
+                this.files = this.files.filter(file => file.name !== change.data.name);
+                this.files.unshift(change.data);
+                filesChanged = true;
+            } else if (change.event === 'file_deleted') {
+                this.files = this.files.filter(file => file.name !== change.filename);
+                filesChanged = true;
+            } else if (change.filename === this.currentShareFile) {
+                // Share created or deleted for the file in the open share modal
+                this.loadExistingShares(change.filename);
+            }
+        });
+
+        if (filesChanged) {
+            if (this.searchQuery) {
+                this.loadFiles();
+            } else {
+                this.renderFiles();
+            }
+            this.loadStorageInfo();
+        }
+    }
+
     showLoading() {
         this.loadingFiles.style.display = 'block';
         this.filesContainer.innerHTML = '';
@@ -201,6 +276,17 @@ class CloudStorage {
     }
 
     renderFiles() {
+        if (this.files.length === 0 && this.searchQuery) {
+            this.filesContainer.innerHTML = `
+                <div class="empty-state">
+                    <i class="fas fa-search"></i>
+                    <h3>No matching files</h3>
+                    <p>Try a different search term</p>
+                </div>
+            `;
+            return;
+        }
+
         if (this.files.length === 0) {
             this.filesContainer.innerHTML = `
                 <div class="empty-state">
@@ -321,16 +407,25 @@ class CloudStorage {
         this.currentUploadController = null;
         this.resetUploadTracking();
         
-        // Hide upload progress and refresh
+        // Hide upload progress (the change feed brings in the new files)
         this.hideUploadProgress();
-        this.loadFiles();
-        this.loadStorageInfo();
         
         // Reset file input
         this.fileInput.value = '';
     }
 
     async uploadFile(file, current, total) {
+        if (this.canUploadDelta(file)) {
+            try {
+                return await this.uploadDelta(file, current, total);
+            } catch (error) {
+                if (error.message === 'Upload was cancelled') {
+                    throw error;
+                }
+                this.showToast('warning', `Delta upload failed, sending the whole file: ${error.message}`);
+            }
+        }
+
         return new Promise((resolve, reject) => {
             const formData = new FormData();
             formData.append('file', file);
@@ -417,6 +512,165 @@ class CloudStorage {
         });
     }
 
+    canUploadDelta(file) {
+        if (file.size < this.deltaMinSize || !window.Worker || !(window.crypto && crypto.subtle)) {
+            return false;
+        }
+        if (!this.files.some(existing => existing.name === file.name)) {
+            return false;
+        }
+        return confirm(`"${file.name}" already exists. Replace it by sending only the changed parts?\n\nCancel uploads it as a separate copy.`);
+    }
+
+    async uploadDelta(file, current, total) {
+        this.progressText.innerHTML = `
+            <div class="upload-details">
+                <div class="file-info">Comparing: ${file.name} (${current}/${total})</div>
+            </div>
+        `;
+
+        const response = await fetch(`${this.apiBase}/delta/${encodeURIComponent(file.name)}/signature`);
+        const signature = await response.json();
+        if (!signature.success) {
+            throw new Error(signature.error);
+        }
+
+        const delta = await this.computeDelta(file, signature, current, total);
+        const body = this.buildDeltaBody(file, delta.ops);
+
+        return new Promise((resolve, reject) => {
+            const xhr = new XMLHttpRequest();
+
+            xhr.upload.addEventListener('progress', (event) => {
+                if (event.lengthComputable) {
+                    const fileProgress = (event.loaded / event.total) * 100;
+                    const overallProgress = (((current - 1) / total) + (fileProgress / 100 / total)) * 100;
+                    this.progressFill.style.width = `${overallProgress}%`;
+
+                    const sentMB = (event.loaded / 1024 / 1024).toFixed(1);
+                    const deltaMB = (event.total / 1024 / 1024).toFixed(1);
+                    const fileMB = (file.size / 1024 / 1024).toFixed(1);
+                    this.progressText.innerHTML = `
+                        <div class="upload-details">
+                            <div class="file-info">Sending changes: ${file.name} (${current}/${total})</div>
+                            <div class="progress-info">
+                                <span>${sentMB}MB / ${deltaMB}MB (file is ${fileMB}MB)</span>
+                                <span>${fileProgress.toFixed(1)}%</span>
+                            </div>
+                        </div>
+                    `;
+                }
+            });
+
+            xhr.addEventListener('load', () => {
+                let data;
+                try {
+                    data = JSON.parse(xhr.responseText);
+                } catch (error) {
+                    reject(new Error('Invalid server response'));
+                    return;
+                }
+                if (xhr.status === 200 && data.success) {
+                    this.showToast('success', data.message);
+                    this.progressFill.style.width = `${(current / total) * 100}%`;
+                    resolve(data);
+                } else {
+                    reject(new Error(data.error || `Upload failed with status: ${xhr.status}`));
+                }
+            });
+
+            xhr.addEventListener('error', () => {
+                reject(new Error('Network error during upload'));
+            });
+
+            xhr.addEventListener('abort', () => {
+                reject(new Error('Upload was cancelled'));
+            });
+
+            this.currentUploadController = xhr;
+
+            const params = new URLSearchParams({ version: signature.version, size: file.size });
+            xhr.open('POST', `${this.apiBase}/delta/${encodeURIComponent(file.name)}?${params}`);
+            xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+            xhr.send(body);
+        });
+    }
+
+    computeDelta(file, signature, current, total) {
+        return new Promise((resolve, reject) => {
+            const worker = new Worker(this.deltaWorkerUrl);
+
+            // Let the cancel button stop the comparison as well
+            this.currentUploadController = {
+                abort: () => {
+                    worker.terminate();
+                    reject(new Error('Upload was cancelled'));
+                }
+            };
+
+            worker.onmessage = (event) => {
+                const message = event.data;
+                if (message.type === 'progress') {
+                    const percent = ((message.processed / message.total) * 100).toFixed(1);
+                    this.progressText.innerHTML = `
+                        <div class="upload-details">
+                            <div class="file-info">Comparing: ${file.name} (${current}/${total})</div>
+                            <div class="progress-info"><span>${percent}%</span></div>
+                        </div>
+                    `;
+                    return;
+                }
+                worker.terminate();
+                if (message.type === 'done') {
+                    resolve(message);
+                } else {
+                    reject(new Error(message.message));
+                }
+            };
+
+            worker.onerror = (event) => {
+                worker.terminate();
+                reject(new Error(event.message || 'Delta worker failed'));
+            };
+
+            worker.postMessage({
+                file: file,
+                blockSize: signature.block_size,
+                baseSize: signature.size,
+                weak: signature.weak,
+                strong: signature.strong
+            });
+        });
+    }
+
+    buildDeltaBody(file, ops) {
+        // Binary format read by apply_delta() in app.py; literal data stays a File slice
+        const parts = [];
+
+        ops.forEach(op => {
+            if (op.copy !== undefined) {
+                const header = new DataView(new ArrayBuffer(9));
+                header.setUint8(0, 0x43); // 'C'
+                header.setUint32(1, op.copy);
+                header.setUint32(5, op.count);
+                parts.push(header.buffer);
+            } else {
+                const [offset, length] = op.data;
+                const header = new DataView(new ArrayBuffer(5));
+                header.setUint8(0, 0x44); // 'D'
+                header.setUint32(1, length);
+                parts.push(header.buffer, file.slice(offset, offset + length));
+            }
+        });
+
+        const end = new DataView(new ArrayBuffer(9));
+        end.setUint8(0, 0x45); // 'E'
+        end.setBigUint64(1, BigInt(file.size));
+        parts.push(end.buffer);
+
+        return new Blob(parts);
+    }
+
     showUploadProgress() {
         this.uploadProgress.style.display = 'flex';
         this.progressFill.style.width = '0%';
@@ -485,8 +739,6 @@ class CloudStorage {
 
             if (data.success) {
                 this.showToast('success', data.message);
-                this.loadFiles();
-                this.loadStorageInfo();
             } else {
                 this.showToast('error', 'Failed to delete file: ' + data.error);
             }
@@ -505,6 +757,7 @@ class CloudStorage {
         this.expiresInput.value = '';
         this.maxDownloadsInput.value = '';
         this.passwordShareInput.value = '';
+        this.signedShareInput.checked = false;
         
         // Load existing shares
         this.loadExistingShares(filename);
@@ -541,14 +794,16 @@ class CloudStorage {
             const expiresText = share.expires_at 
                 ? new Date(share.expires_at).toLocaleString()
                 : 'Never';
-            const downloadsText = share.max_downloads 
-                ? `${share.download_count}/${share.max_downloads}`
-                : `${share.download_count}/∞`;
+            const downloadsText = share.signed
+                ? 'Not tracked'
+                : share.max_downloads 
+                    ? `${share.download_count}/${share.max_downloads}`
+                    : `${share.download_count}/∞`;
 
             return `
                 <div class="share-item">
                     <div class="share-item-header">
-                        <span><strong>ID:</strong> ${share.share_id}</span>
+                        <span><strong>ID:</strong> ${share.signed ? 'Signed link' : share.share_id}</span>
                         <button class="btn btn-danger btn-sm" onclick="cloudStorage.deleteShare('${share.share_id}')">
                             <i class="fas fa-trash"></i>
                         </button>
@@ -587,6 +842,10 @@ class CloudStorage {
             shareData.password = this.passwordShareInput.value;
         }
 
+        if (this.signedShareInput.checked) {
+            shareData.signed = true;
+        }
+
         try {
             this.createShare.disabled = true;
             this.createShare.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Creating...';
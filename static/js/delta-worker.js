@@ -0,0 +1,123 @@
+// Delta upload worker
+// Compares a local file against the block signature of the server's copy and
+// works out which ranges can be copied from the server and which must be sent.
+// Weak checksum: Adler-32 (same as zlib.adler32 on the server), rolled byte by byte.
+// Strong checksum: first 16 bytes of SHA-256, only computed when the weak one matches.
+
+const ADLER_MOD = 65521;
+const READ_CHUNK_SIZE = 16 * 1024 * 1024;
+const PROGRESS_INTERVAL = 16 * 1024 * 1024;
+
+self.onmessage = async (event) => {
+    try {
+        const result = await computeDelta(event.data);
+        self.postMessage({ type: 'done', ...result });
+    } catch (error) {
+        self.postMessage({ type: 'error', message: error.message });
+    }
+};
+
+function adler32(buffer, start, length) {
+    let a = 1;
+    let b = 0;
+    for (let i = start; i < start + length; i++) {
+        a = (a + buffer[i]) % ADLER_MOD;
+        b = (b + a) % ADLER_MOD;
+    }
+    return [a, b];
+}
+
+async function strongChecksum(bytes) {
+    const digest = new Uint8Array(await crypto.subtle.digest('SHA-256', bytes));
+    let hex = '';
+    for (let i = 0; i < 16; i++) {
+        hex += digest[i].toString(16).padStart(2, '0');
+    }
+    return hex;
+}
+
+async function computeDelta({ file, blockSize, baseSize, weak, strong }) {
+    // Only full blocks can match at arbitrary offsets
+    const table = new Map();
+    const fullBlocks = Math.floor(baseSize / blockSize);
+    for (let i = 0; i < fullBlocks; i++) {
+        if (!table.has(weak[i])) table.set(weak[i], []);
+        table.get(weak[i]).push(i);
+    }
+
+    const reader = new FileReaderSync();
+    const chunkSize = Math.max(READ_CHUNK_SIZE, blockSize * 4);
+    const size = file.size;
+    const ops = [];
+    let literalBytes = 0;
+    let literalStart = 0;
+    let pos = 0;
+    let nextProgress = PROGRESS_INTERVAL;
+    let buffer = null;
+    let bufferStart = 0;
+    let a = 0;
+    let b = 0;
+    let haveChecksum = false;
+
+    const pushLiteral = (end) => {
+        if (end > literalStart) {
+            ops.push({ data: [literalStart, end - literalStart] });
+            literalBytes += end - literalStart;
+        }
+    };
+
+    const pushCopy = (index) => {
+        const last = ops[ops.length - 1];
+        if (last && last.copy !== undefined && last.copy + last.count === index) {
+            last.count++;
+        } else {
+            ops.push({ copy: index, count: 1 });
+        }
+    };
+
+    while (pos + blockSize <= size) {
+        if (pos >= nextProgress) {
+            self.postMessage({ type: 'progress', processed: pos, total: size });
+            nextProgress = pos + PROGRESS_INTERVAL;
+        }
+
+        if (!buffer || pos + blockSize > bufferStart + buffer.length) {
+            bufferStart = pos;
+            buffer = new Uint8Array(reader.readAsArrayBuffer(file.slice(pos, Math.min(size, pos + chunkSize))));
+            haveChecksum = false;
+        }
+
+        const offset = pos - bufferStart;
+        if (!haveChecksum) {
+            [a, b] = adler32(buffer, offset, blockSize);
+            haveChecksum = true;
+        }
+
+        const candidates = table.get(b * 65536 + a);
+        if (candidates) {
+            const checksum = await strongChecksum(buffer.subarray(offset, offset + blockSize));
+            const index = candidates.find(i => strong[i] === checksum);
+            if (index !== undefined) {
+                pushLiteral(pos);
+                pushCopy(index);
+                pos += blockSize;
+                literalStart = pos;
+                haveChecksum = false;
+                continue;
+            }
+        }
+
+        // Roll the window one byte forward
+        if (offset + blockSize < buffer.length) {
+            const outgoing = buffer[offset];
+            a = ((a - outgoing + buffer[offset + blockSize]) % ADLER_MOD + ADLER_MOD) % ADLER_MOD;
+            b = ((b - blockSize * outgoing + a - 1) % ADLER_MOD + ADLER_MOD) % ADLER_MOD;
+        } else {
+            haveChecksum = false;
+        }
+        pos++;
+    }
+
+    pushLiteral(size);
+    return { ops, literalBytes };
+}
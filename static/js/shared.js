@@ -0,0 +1,86 @@
+// Shared file landing page
+document.addEventListener('DOMContentLoaded', function() {
+    const downloadBtn = document.getElementById('downloadBtn');
+    const passwordInput = document.getElementById('passwordInput');
+    const messageContainer = document.getElementById('messageContainer');
+
+    // Format expiry time if present
+    const expiryElement = document.getElementById('expiryTime');
+    if (expiryElement) {
+        const expiryDate = new Date(expiryElement.textContent);
+        expiryElement.textContent = expiryDate.toLocaleString();
+    }
+
+    downloadBtn.addEventListener('click', async function() {
+        const shareId = downloadBtn.dataset.shareId;
+        const hasPassword = downloadBtn.dataset.hasPassword === 'true';
+
+        let requestData = {};
+
+        if (hasPassword) {
+            const password = passwordInput.value.trim();
+            if (!password) {
+                showMessage('Please enter the password', 'error');
+                return;
+            }
+            requestData.password = password;
+        }
+
+        try {
+            downloadBtn.disabled = true;
+            downloadBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Downloading...';
+
+            const response = await fetch(`/api/share/${shareId}/download`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify(requestData)
+            });
+
+            if (response.ok) {
+                // Create download link
+                const blob = await response.blob();
+                const url = window.URL.createObjectURL(blob);
+                const a = document.createElement('a');
+                a.href = url;
+                a.download = downloadBtn.dataset.filename;
+                document.body.appendChild(a);
+                a.click();
+                window.URL.revokeObjectURL(url);
+                document.body.removeChild(a);
+
+                showMessage('Download started successfully!', 'success');
+            } else {
+                const data = await response.json();
+                showMessage(data.error || 'Download failed', 'error');
+            }
+        } catch (error) {
+            showMessage('Network error. Please try again.', 'error');
+        } finally {
+            downloadBtn.disabled = false;
+            downloadBtn.innerHTML = '<i class="fas fa-download"></i> Download File';
+        }
+    });
+
+    // Allow Enter key to submit password
+    if (passwordInput) {
+        passwordInput.addEventListener('keypress', function(e) {
+            if (e.key === 'Enter') {
+                downloadBtn.click();
+            }
+        });
+    }
+
+    function showMessage(message, type) {
+        messageContainer.innerHTML = `
+            <div class="${type}-message">
+                ${message}
+            </div>
+        `;
+
+        setTimeout(() => {
+            messageContainer.innerHTML = '';
+        }, 5000);
+    }
+});